@@ -1,10 +1,10 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import re
-import math
-import matplotlib.pyplot as plt
-import plotly.express as px
-import io
+import hashlib
+
+APP_VERSION = "2.6.4"
 
 # ==========================================
 # FIXED PHYSICAL CONSTANTS
@@ -12,36 +12,145 @@ import io
 TEMP = 298.15
 GAS_CONST = 0.001987204
 AU_TO_KCAL = 627.5095
+INV_KT = 1.0 / (GAS_CONST * TEMP)  # 1/(kcal/mol)
 WAVELENGTH_LABEL = "589.3 nm (D-line)"
 
-def extract_energy(content):
-    match = re.search(r"Sum of electronic and thermal Free Energies=\s+(-?\d+\.\d+)", content)
-    if not match:
-        match = re.search(r"SCF Done:.*?=\s+(-?\d+\.\d+)", content)
-    return float(match.group(1)) if match else None
+# Gaussian prints the thermochemistry and [Alpha] summaries at the end of the job
+TAIL_BYTES = 262144
+
+# Log patterns run on raw bytes: Gaussian output is ASCII, so no decode is needed
+_ENERGY_RE = re.compile(rb"Sum of electronic and thermal Free Energies=\s+(?P<free>-?\d+\.\d+)"
+                        rb"|SCF Done:.*?=\s+(?P<scf>-?\d+\.\d+)")
+_GL_SECTION_RE = re.compile(rb"Optical Rotation GL:.*?(?=\n\s*\n|Optical Rotation GL\*W|Optical Rotation|$)", re.DOTALL)
+_ALPHA_WL_RE = re.compile(rb"\[Alpha\]\s+\(\s*[\d\.]+\s+A\)\s+=\s+(-?\d+\.\d+)")
+_ALPHA_STATIC_RE = re.compile(rb"\[Alpha\]D\s+\(static\)\s+=\s+(-?\d+\.\d+)")
+_ALPHA_RE = re.compile(rb"\[Alpha\]\s+\(\s*[\d\.]+\s+A\)\s+=\s+(?P<wl>-?\d+\.\d+)"
+                       rb"|\[Alpha\].*?=\s+(?P<deg>-?\d+\.\d+)\s+deg\.")
+_EXT_RE = re.compile(r"\.(log|out)$", re.IGNORECASE)
+_BASE_ID_RE = re.compile(r"(\d+)$")
+
+def extract_energy(content, primary_only=False):
+    # One pass: the free energy wins, otherwise the first SCF Done
+    scf = None
+    for match in _ENERGY_RE.finditer(content):
+        if match.group("free"): return float(match.group("free"))
+        if scf is None: scf = float(match.group("scf"))
+    return None if primary_only else scf
 
-def extract_sr(content):
-    gl_section = re.search(r"Optical Rotation GL:.*?(?=\n\s*\n|Optical Rotation GL\*W|Optical Rotation|$)", content, re.DOTALL)
+def extract_sr(content, primary_only=False):
+    gl_section = _GL_SECTION_RE.search(content)
     if gl_section:
         section_text = gl_section.group(0)
-        match = re.search(r"\[Alpha\]\s+\(\s*[\d\.]+\s+A\)\s+=\s+(-?\d+\.\d+)", section_text)
+        match = _ALPHA_WL_RE.search(section_text)
         if match: return float(match.group(1))
-        match = re.search(r"\[Alpha\]D\s+\(static\)\s+=\s+(-?\d+\.\d+)", section_text)
+        match = _ALPHA_STATIC_RE.search(section_text)
         if match: return float(match.group(1))
+    if primary_only: return None
 
-    matches = re.findall(r"\[Alpha\]\s+\(\s*[\d\.]+\s+A\)\s+=\s+(-?\d+\.\d+)", content)
-    if matches: return float(matches[-1])
-    match = re.search(r"\[Alpha\].*?=\s+(-?\d+\.\d+)\s+deg\.", content)
-    return float(match.group(1)) if match else None
+    # One pass: the last wavelength-tagged [Alpha] wins, otherwise the first "deg." line
+    last_wl, first_deg = None, None
+    for match in _ALPHA_RE.finditer(content):
+        if match.group("wl"): last_wl = match.group("wl")
+        elif first_deg is None: first_deg = match.group("deg")
+    val = last_wl or first_deg
+    return float(val) if val else None
 
 def get_base_id(filename):
-    name = filename.lower().replace(".log", "").replace(".out", "")
-    match = re.search(r"(\d+)$", name)
-    return match.group(1) if match else name
+    stem = _EXT_RE.sub("", filename)
+    match = _BASE_ID_RE.search(stem)
+    return match.group(1) if match else stem.lower()
+
+_EXTRACTORS = {"energy": extract_energy, "sr": extract_sr}
+_PRIMARY_MARKER_RE = {"energy": re.compile(rb"Sum of electronic and thermal Free Energies"),
+                      "sr": re.compile(rb"Optical Rotation GL:")}
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def parse_log(digest, _data, kind, primary_only=False):
+    # Keyed on the blake2b digest; the leading underscore keeps st.cache_data from re-hashing the bytes
+    return _EXTRACTORS[kind](_data, primary_only)
+
+def fingerprint(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def read_tail(f, n=TAIL_BYTES):
+    f.seek(max(0, f.size - n))
+    tail = f.read()
+    f.seek(0)
+    return tail
+
+def head_has_marker(f, kind):
+    # Searches the upload buffer in place (no copy, no decode), overlapping the tail by
+    # len(marker) - 1 bytes so a marker straddling the boundary still counts as earlier
+    marker = _PRIMARY_MARKER_RE[kind]
+    end = f.size - TAIL_BYTES + len(marker.pattern) - 1
+    with f.getbuffer() as buf:
+        return marker.search(buf, 0, end) is not None
+
+def scan_upload(f, kind):
+    # A partial tail only decides the value when it holds the file's first top-priority match
+    # (free energy / GL section); otherwise the whole log is scanned with the full precedence
+    partial = f.size > TAIL_BYTES
+    if not (partial and head_has_marker(f, kind)):
+        tail = read_tail(f)
+        val = parse_log(fingerprint(tail), tail, kind, partial)
+        if val is not None or not partial: return val
+    raw = f.getvalue()
+    return parse_log(fingerprint(raw), raw, kind)
+
+def parse_all(files, kind):
+    # Per-session results keyed on the upload's file_id; removed uploads are evicted
+    files = files or []
+    parsed = st.session_state.setdefault(f"parsed_{kind}", {})
+    for stale in parsed.keys() - {f.file_id for f in files}: del parsed[stale]
+    for f in files:
+        if f.file_id not in parsed: parsed[f.file_id] = scan_upload(f, kind)
+    return [(f.name, parsed[f.file_id]) for f in files]
+
+def boltzmann_kernel(energies, srs):
+    e = np.ascontiguousarray(energies, dtype=np.float64)
+    dG = np.empty_like(e)
+    np.subtract(e, e.min(), out=dG)
+    # Softmax over -dG/RT: one combined scale from Hartree, max-shift, exp in place
+    a = dG * (-AU_TO_KCAL * INV_KT)
+    a -= a.max()
+    w = np.exp(a, out=a)
+    pop = w * (100.0 / w.sum())
+    dG *= AU_TO_KCAL
+    contrib = np.asarray(srs, dtype=np.float64) * pop / 100
+    return dG, pop, contrib, contrib.sum()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_plot(df, final_sr):
+    # Keyed on the plot inputs only, so exp_val edits reuse the figure
+    import plotly.express as px  # deferred: not needed until results exist
+    # float32 is ample for plotting and halves the typed arrays sent to the browser; df stays float64 for the CSV
+    plot_df = df.astype({"dG_kcal_mol": np.float32, "Raw_SR": np.float32, "Pop_percent": np.float32})
+    fig = px.scatter(plot_df, x="dG_kcal_mol", y="Raw_SR", size="Pop_percent", color="Pop_percent",
+                     hover_name="ID", template="plotly_white", color_continuous_scale="Viridis")
+    fig.add_hline(y=final_sr, line_dash="dash", line_color="red")
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def compute_boltzmann(ready):
+    # Independent of exp_val, so editing the reference reuses the table and the CSV
+    ids, files, energies, srs = zip(*ready)
+    energies = np.asarray(energies, dtype=np.float64)
+    srs = np.asarray(srs, dtype=np.float64)
+    dG, pop, contrib, final_sr = boltzmann_kernel(energies, srs)
+    df = pd.DataFrame({"ID": list(ids), "File": list(files), "Energy_Ha": energies, "Raw_SR": srs,
+                       "dG_kcal_mol": dG, "Pop_percent": pop, "Contribution": contrib})
+
+    # --- Excel-Friendly CSV Export ---
+    # Summary row is appended as text; columns: ID,File,Energy_Ha,Raw_SR,dG_kcal_mol,Pop_percent,Contribution
+    summary_line = f"TOTAL_AVERAGE,Result for {WAVELENGTH_LABEL},,{final_sr},,100.0,{final_sr}\n"
+    
+    # encoding='utf-8-sig' makes it readable in Excel without mojibake
+    csv_output = (df.to_csv(index=False) + summary_line).encode("utf-8-sig")
+    return df, final_sr, csv_output
 
 # --- UI ---
-st.set_page_config(page_title="SR-Boltzmann-Lab v2.6.4", layout="wide")
-st.title("SR-Boltzmann-Lab v2.6.4 (Excel Optimized)")
+st.set_page_config(page_title=f"SR-Boltzmann-Lab v{APP_VERSION}", layout="wide")
+st.title(f"SR-Boltzmann-Lab v{APP_VERSION} (Excel Optimized)")
 
 with st.sidebar:
     st.header("1. Experimental Reference")
@@ -54,62 +163,40 @@ col1, col2 = st.columns(2)
 with col1: energy_files = st.file_uploader("1. Energy Logs", accept_multiple_files=True, key="eng")
 with col2: sr_files = st.file_uploader("2. SR Logs", accept_multiple_files=True, key="sr")
 
-data_map = {}
-if energy_files:
-    for f in energy_files:
-        val = extract_energy(f.getvalue().decode("utf-8"))
-        if val: data_map[get_base_id(f.name)] = {"name": f.name, "energy": val, "sr": None}
-if sr_files:
-    for f in sr_files:
-        file_id = get_base_id(f.name)
-        val = extract_sr(f.getvalue().decode("utf-8"))
-        if val:
-            if file_id in data_map: data_map[file_id]["sr"] = val
-            else: data_map[file_id] = {"name": f.name, "energy": None, "sr": val}
-
-ready_data = [{"ID": k, "File": v["name"], "Energy_Ha": v["energy"], "Raw_SR": v["sr"]} 
-              for k, v in data_map.items() if v["energy"] is not None and v["sr"] is not None]
-
-if ready_data:
-    df = pd.DataFrame(ready_data)
-    min_e = df["Energy_Ha"].min()
-    df["dG_kcal_mol"] = (df["Energy_Ha"] - min_e) * AU_TO_KCAL
-    df["Pop_percent"] = (df["dG_kcal_mol"].apply(lambda x: math.exp(-x / (GAS_CONST * TEMP))) / 
-                         df["dG_kcal_mol"].apply(lambda x: math.exp(-x / (GAS_CONST * TEMP))).sum()) * 100
-    df["Contribution"] = df["Raw_SR"] * (df["Pop_percent"] / 100)
-    final_sr = df["Contribution"].sum()
+# Reruns with the same uploads (e.g. an exp_val edit) reuse the last results without re-pairing
+upload_key = (tuple(f.file_id for f in energy_files or []), tuple(f.file_id for f in sr_files or []))
+if st.session_state.get("upload_key") != upload_key:
+    energy_map = {get_base_id(name): (name, val) for name, val in parse_all(energy_files, "energy") if val is not None}
+    sr_map = {get_base_id(name): val for name, val in parse_all(sr_files, "sr") if val is not None}
+    # Only IDs present on both sides are kept, in energy-upload order
+    ready = tuple((k, name, energy, sr_map[k]) for k, (name, energy) in energy_map.items() if k in sr_map)
+    st.session_state.results = compute_boltzmann(ready) if ready else None
+    st.session_state.upload_key = upload_key
+
+if st.session_state.results:
+    df, final_sr, csv_output = st.session_state.results
 
     st.write("---")
     res_col, plot_col = st.columns([2, 3])
     with res_col:
         st.subheader("📊 Summary")
-        st.table(df[["ID", "dG_kcal_mol", "Pop_percent", "Raw_SR", "Contribution"]])
+        # Number formatting is done by the frontend via column_config
+        st.dataframe(df[["ID", "dG_kcal_mol", "Pop_percent", "Raw_SR", "Contribution"]], column_config={
+            "dG_kcal_mol": st.column_config.NumberColumn(format="%.2f"),
+            "Pop_percent": st.column_config.NumberColumn(format="%.2f"),
+            "Raw_SR": st.column_config.NumberColumn(format="%.2f"),
+            "Contribution": st.column_config.NumberColumn(format="%.2f"),
+        }, hide_index=True, width="stretch")
         diff = final_sr - exp_val if exp_val != 0 else None
         st.metric(label="Boltzmann Averaged Alpha_D", value=f"{final_sr:.2f}", 
                   delta=f"{diff:.2f} vs Exp." if diff is not None else None)
 
     with plot_col:
-        fig = px.scatter(df, x="dG_kcal_mol", y="Raw_SR", size="Pop_percent", color="Pop_percent",
-                         hover_name="ID", template="plotly_white", color_continuous_scale="Viridis")
-        fig.add_hline(y=final_sr, line_dash="dash", line_color="red")
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(build_plot(df, final_sr), width="stretch")
 
-    # --- Excel-Friendly CSV Export ---
-    summary_row = pd.DataFrame([{
-        "ID": "TOTAL_AVERAGE", 
-        "File": f"Result for {WAVELENGTH_LABEL}",
-        "Raw_SR": final_sr,
-        "Contribution": final_sr,
-        "Pop_percent": 100.0
-    }])
-    csv_df = pd.concat([df, summary_row], ignore_index=True)
-    
-    # encoding='utf-8-sig' makes it readable in Excel without mojibake
-    csv_output = csv_df.to_csv(index=False, encoding='utf-8-sig')
-    
     st.download_button(
         label="Download SI-Ready CSV (Excel OK)", 
         data=csv_output, 
-        file_name=f"SR_Analysis_v2.6.4_{final_sr:.1f}.csv",
+        file_name=f"SR_Analysis_v{APP_VERSION}_{final_sr:.1f}.csv",
         mime="text/csv"
     )
\ No newline at end of file